@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
 import sys
-import io
 import os
 import argparse
+import ast
 import sysconfig
 import shutil
 import zipfile
-from modulefinder import ModuleFinder
+import zlib
+import struct
+import mmap
+import functools
+import marshal
+import hashlib
+import json
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple, deque
+from importlib.machinery import (
+    PathFinder, SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
 from pathlib import Path
 from datetime import datetime
 try:
@@ -23,63 +34,304 @@ except ImportError:
 exec(compile(
     # The zip from which __main__ was loaded:
     open(__loader__.archive, 'rb').read(
-        # minimum offset = size of file before zip start:
-        min(f[4] for f in getattr(__loader__, '_get_files', lambda: __loader__._files)().values())
+        # __main__.py is the first entry, so its offset = size of file before zip start:
+        getattr(__loader__, '_get_files', lambda: __loader__._files)()['__main__.py'][4]
     ).decode('utf8', 'surrogateescape'),
     __loader__.archive,     # set filename in code object
     'exec'                  # compile in 'exec' mode
 ))'''
 
+# Entries created by carryon itself rather than taken from dependencies
+BOOTSTRAP_NAMES = ('__main__.py', '__main__.pyc')
+
 CARRYON_MARKER = b'\n\n##CarryOn bundled dependencies below this line##\n'
 
+# Loaders of modules that live in plain files we can bundle
+FILE_LOADERS = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+# Extension modules need zipext to be importable from the zip
+EXTENSION_SUFFIXES = {'.so', '.pyd'}
+
+# Files too small to gain from deflate, or that are already compressed
+MIN_DEFLATE_SIZE = 64
+COMPRESSED_SUFFIXES = {
+    '.whl', '.zip', '.egg', '.gz', '.tgz', '.bz2', '.xz', '.zst',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.woff', '.woff2',
+}
+
+# Number of files read and compressed ahead of the zip writer
+PREFETCH_WINDOW = 64
+
+# Bundles with fewer files are compressed without a thread pool
+MIN_PARALLEL_FILES = 4
+
+# Larger files are streamed into the zip in chunks instead of read whole
+MAX_BUFFERED_SIZE = 1 << 20
+STREAM_CHUNK_SIZE = 1 << 20
+
+# Deflate levels: zlib's default, fastest for iteration, smallest for release
+DEFLATE_LEVEL = 6
+FAST_DEFLATE_LEVEL = 1
+BEST_DEFLATE_LEVEL = 9
+
+# Bump when scan_imports() results or the cache layout change, so caches
+# written by older versions are not reused
+IMPORTS_CACHE_VERSION = 1
+
+# Zstandard level, as zipfile itself defaults to for ZIP_ZSTANDARD
+ZSTD_LEVEL = 3
+
+# Unless a level is given, streamed files dominate packing time and gain
+# little from a higher level, so they get the fast one
+STREAMED_DEFLATE_LEVEL = FAST_DEFLATE_LEVEL
+
+# Stdlib directories as plain strings, both as configured and resolved
+STDLIB_PATHS = frozenset(
+    path
+    for p in (sysconfig.get_path('stdlib'),
+              os.path.join(sysconfig.get_path('platstdlib'), 'lib-dynload'))
+    for path in (os.path.normpath(p), os.path.realpath(p))
+)
+
+# Top-level names of stdlib modules (the former are known on Python 3.10+)
+STDLIB_NAMES = frozenset(getattr(sys, 'stdlib_module_names', ())).union(
+    sys.builtin_module_names)
+
+# Result of locating a module: origin is None unless it is a bundleable file
+ResolvedModule = namedtuple('ResolvedModule',
+                            'origin search_locations is_stdlib')
+
 
 class ZipextNotFoundError(Exception):
     """Raised when zipext is needed but not available"""
     pass
 
 
-def find_module_dependencies(script_path):
-    # Convert script path to absolute and sys.path to Path objects
-    script_path = Path(script_path).resolve()
-    sys_paths = [script_path.parent if p == '' else Path(p) for p in sys.path]
+def scan_imports(path, name='__main__', is_package=False):
+    """Generate absolute names of modules imported by a source file"""
+    # The script may already have a zip appended; parse only the part
+    # before it, as the bootstrap compiles
+    size = find_script_size(path) if name == '__main__' else None
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(size), str(path))
+    package = name if is_package else name.rpartition('.')[0]
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                # Relative import: drop one trailing component per extra dot
+                bits = package.rsplit('.', node.level - 1)
+                if not package or len(bits) < node.level:
+                    continue
+                module = bits[0] + '.' + node.module if node.module else bits[0]
+            else:
+                module = node.module
+            yield module
+            # Names imported from a package may be submodules
+            for alias in node.names:
+                if alias.name != '*':
+                    yield module + '.' + alias.name
+
+
+def file_stamp(path):
+    """Return [mtime_ns, size] of path, or None if it cannot be stat()ed"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def cached_scan_imports(cache, path, name='__main__', is_package=False):
+    """Like scan_imports, reusing results in cache while path is unchanged"""
+    stamp = file_stamp(path)
+    entry = cache.get(path)
+    # Anything but a well-formed entry for this exact file is a miss
+    if (isinstance(entry, list) and len(entry) == 4 and
+            entry[:3] == [stamp, name, is_package] and
+            isinstance(entry[3], list) and
+            all(isinstance(imported, str) for imported in entry[3])):
+        return entry[3]
+    imported = sorted(set(scan_imports(path, name, is_package)))
+    cache[path] = [stamp, name, is_package, imported]
+    return imported
+
+
+def imports_cache_path(script_path):
+    """Path of the file persisting scan results for script_path"""
+    cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                  os.path.join(os.path.expanduser('~'), '.cache'))
+    # One file per script and cache format, as parsing also depends on the
+    # running Python's grammar
+    key = os.fspath(Path(script_path).resolve()).encode('utf8', 'surrogateescape')
+    version = '%d.%d' % sys.version_info[:2]
+    name = 'imports-v%d-%s-%s.json' % (IMPORTS_CACHE_VERSION, version,
+                                       hashlib.sha1(key).hexdigest())
+    return os.path.join(cache_home, 'carryon', name)
+
+
+def load_imports_cache(script_path):
+    """Load scan results saved by an earlier run, if any"""
+    try:
+        with open(imports_cache_path(script_path)) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
 
-    # Get stdlib paths
-    stdlib_paths = {
-        Path(sysconfig.get_path('stdlib')),
-        Path(sysconfig.get_path('platstdlib')) / 'lib-dynload'
-    }
 
-    def find_base(module):
-        if not module.__file__:
+def save_imports_cache(script_path, cache):
+    """Save scan results for later runs; packing works the same without"""
+    path = imports_cache_path(script_path)
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+
+def find_spec(name, path):
+    """Like PathFinder.find_spec, but leave namespace packages' paths a list
+
+    PathFinder wraps them in a _NamespacePath, which looks up the parent
+    module in sys.modules and so fails for namespace packages nested in one
+    that was never imported, like google.cloud.
+    """
+    get_spec = getattr(PathFinder, '_get_spec', None)
+    if get_spec is None:
+        return PathFinder.find_spec(name, path)
+    spec = get_spec(name, path)
+    if spec is None or spec.loader is not None:
+        return spec
+    return spec if spec.submodule_search_locations else None
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_module(name, search_path):
+    """Locate module without importing it or its parent packages"""
+    if name.partition('.')[0] in STDLIB_NAMES:
+        return ResolvedModule(None, None, True)
+
+    module = sys.modules.get(name)
+    spec = getattr(module, '__spec__', None)
+    if spec is None:
+        parent = name.rpartition('.')[0]
+        if parent:
+            parent = resolve_module(parent, search_path)
+            path = parent and parent.search_locations
+            spec = find_spec(name, list(path)) if path else None
+        else:
+            spec = find_spec(name, list(search_path))
+        if spec is None:
             return None
-        modpath = Path(module.__file__).resolve()
-        if modpath == script_path:  # Skip the script itself
+
+    locations = spec.submodule_search_locations
+    if locations is not None:
+        # An imported namespace package's _NamespacePath recalculates
+        # itself when iterated; take the paths it was found with
+        locations = tuple(getattr(locations, '_path', locations))
+    if spec.origin in ('built-in', 'frozen'):
+        return ResolvedModule(None, locations, True)
+    if not isinstance(spec.loader, FILE_LOADERS):
+        return ResolvedModule(None, locations, False)   # Namespace package
+
+    # Directory the top-level package was found in
+    base = spec.origin
+    for _ in range(name.count('.') + (locations is not None) + 1):
+        base = os.path.dirname(base)
+    return ResolvedModule(spec.origin, locations, base in STDLIB_PATHS)
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_dir(path):
+    """Resolve symlinks in a directory path, once per directory"""
+    return os.path.realpath(path)
+
+
+def find_module_dependencies(script_path, imports_cache=None):
+    # Convert script path to absolute and sys.path to Path objects
+    script_path = Path(script_path).resolve()
+    sys_paths = [script_path.parent if p == '' else Path(p) for p in sys.path]
+    search_path = tuple(str(p) for p in sys_paths)
+
+    # Resolve sys.path entries once, with a trailing separator for matching
+    resolved_paths = [(os.path.join(resolve_dir(str(p)), ''), p)
+                      for p in sys_paths]
+    script_file = str(script_path)
+
+    def find_base(name, filename):
+        # Modules share few directories, so only those are resolved
+        dirname, basename = os.path.split(os.path.abspath(filename))
+        modpath = os.path.join(resolve_dir(dirname), basename)
+        if modpath == script_file:  # Skip the script itself
             return None
 
-        for base in sys_paths:
-            try:
-                relpath = modpath.relative_to(base)
-                path_depth = len(relpath.parts)
-                if relpath.name.startswith('__init__.'):
-                    path_depth -= 1
-                if path_depth == len(module.__name__.split('.')):
-                    return base, relpath
-            except ValueError:
+        # The matching entry leaves one path component per name component
+        depth = name.count('.') + 1
+        for prefix, base in resolved_paths:
+            if not modpath.startswith(prefix):
                 continue
+            relpath = modpath[len(prefix):]
+            path_depth = relpath.count(os.sep) + 1
+            if os.path.basename(relpath).startswith('__init__.'):
+                path_depth -= 1
+            if path_depth == depth:
+                return base, Path(relpath)
         return None
 
-    # Run modulefinder on target script
-    finder = ModuleFinder()
-    finder.run_script(str(script_path))
-
-    # Yield non-stdlib dependencies
-    for module in finder.modules.values():
-        result = find_base(module)
-        if not result:
-            continue
-        if result[0] in stdlib_paths:
-            continue
-        yield result
+    # Scan source files for imports, starting from the target script.
+    # Parsing is most of the work, so results can be kept in imports_cache;
+    # imports are still resolved afresh in case the environment changed.
+    # Entries for files no longer scanned are dropped at the end.
+    if imports_cache is None:
+        scan = scan_imports
+    else:
+        scan = functools.partial(cached_scan_imports, imports_cache)
+    seen = set()
+    scanned = set()
+    todo = [('__main__', str(script_path), False)]
+    while todo:
+        name, path, is_package = todo.pop()
+        scanned.add(path)
+        try:
+            imported = sorted(set(scan(path, name, is_package)))
+        except (OSError, SyntaxError, ValueError):
+            if name == '__main__':
+                raise   # Don't silently pack a script we cannot read
+            continue    # Dependency is still bundled, just not scanned
+
+        for fullname in imported:
+            # Importing a.b.c also imports a and a.b
+            parts = fullname.split('.')
+            for i in range(1, len(parts) + 1):
+                modname = '.'.join(parts[:i])
+                if modname in seen:
+                    continue
+                seen.add(modname)
+                module = resolve_module(modname, search_path)
+                if module is None or module.is_stdlib:
+                    break
+                if module.origin is None:
+                    continue    # Namespace package, nothing to bundle
+
+                # Yield non-stdlib dependencies
+                result = find_base(modname, module.origin)
+                if not result:
+                    break
+                yield result
+                if module.origin.endswith('.py'):
+                    is_pkg = module.search_locations is not None
+                    todo.append((modname, module.origin, is_pkg))
+
+    if imports_cache is not None:
+        for path in imports_cache.keys() - scanned:
+            del imports_cache[path]
 
 
 def normalize_excludes(excludes):
@@ -94,31 +346,41 @@ def normalize_excludes(excludes):
     return result
 
 
+def compile_excludes(excludes):
+    """Convert exclude options to exact names and a tuple of name prefixes"""
+    names = normalize_excludes(excludes)
+    return names, tuple(name + '.' for name in names)
+
+
+def path_to_module_name(relpath):
+    """Convert relative path of a module file to dotted module name format"""
+    module_name = str(relpath).replace(os.sep, '.')
+    if os.altsep:
+        module_name = module_name.replace(os.altsep, '.')
+    if module_name.endswith('.py'):
+        return module_name[:-3]
+    if module_name.endswith('.pyc'):
+        return module_name[:-4]
+    return module_name
+
+
 def filter_mixed_deps(mixed_deps, excludes):
     """Filter mixed dependencies list based on exclude patterns"""
     if not excludes:
         yield from mixed_deps
         return
 
-    excludes = normalize_excludes(excludes)
+    names, prefixes = compile_excludes(excludes)
     for base, item in mixed_deps:
         # For distributions, check package name
         if hasattr(item, 'files'):
-            if item.metadata['Name'] not in excludes:
+            if item.metadata['Name'] not in names:
                 yield base, item
             continue
 
-        # For module paths, check if path starts with any exclude pattern
-        relpath = str(item)
-        module_name = relpath.replace('/', '.').replace('\\', '.')
-        if module_name.endswith('.py'):
-            module_name = module_name[:-3]
-        elif module_name.endswith('.pyc'):
-            module_name = module_name[:-4]
-
         # Skip if module matches any exclude pattern
-        if any(module_name == ex or module_name.startswith(ex + '.')
-               for ex in excludes):
+        module_name = path_to_module_name(item)
+        if module_name in names or module_name.startswith(prefixes):
             continue
 
         yield base, item
@@ -130,75 +392,136 @@ def filter_file_deps(file_deps, excludes):
         yield from file_deps
         return
 
-    excludes = normalize_excludes(excludes)
+    names, prefixes = compile_excludes(excludes)
     for base, relpath in file_deps:
-        # Convert path to module name format
-        path_str = str(relpath)
-        module_name = path_str.replace('/', '.').replace('\\', '.')
-        if module_name.endswith('.py'):
-            module_name = module_name[:-3]
-        elif module_name.endswith('.pyc'):
-            module_name = module_name[:-4]
-
         # Skip if module matches any exclude pattern
-        if any(module_name == ex or module_name.startswith(ex + '.')
-               for ex in excludes):
+        module_name = path_to_module_name(relpath)
+        if module_name in names or module_name.startswith(prefixes):
             continue
 
         yield base, relpath
 
 
+@functools.lru_cache(maxsize=None)
+def find_zipext():
+    """Locate zipext module as a (base, relpath) dependency"""
+    spec = importlib.util.find_spec('zipext')
+    if spec is None or not spec.has_location:
+        raise ZipextNotFoundError(
+            "Extension modules found but zipext not available.\n"
+            "Please install zipext with: pip install zipext"
+        )
+    modpath = Path(spec.origin)
+    base = modpath.parent
+    if spec.submodule_search_locations is not None:
+        base = base.parent
+    return base, modpath.relative_to(base)
+
+
 def process_extension_modules(deps):
-    """Process list looking for extension modules, adding zipext if needed"""
-    has_extensions = False
+    """Pass deps through, adding zipext if there are extension modules"""
+    need_zipext = True
     for base, relpath in deps:
-        if str(relpath).endswith(('.so', '.pyd')):
-            has_extensions = True
-            break
+        if need_zipext and relpath.suffix in EXTENSION_SUFFIXES:
+            need_zipext = False
+            yield find_zipext()
+        yield base, relpath
 
-    if has_extensions:
-        # Try to find zipext module
-        finder = ModuleFinder()
-        try:
-            finder.find_module('zipext')
-        except ImportError:
-            raise ZipextNotFoundError(
-                "Extension modules found but zipext not available.\n"
-                "Please install zipext with: pip install zipext"
-            )
-
-        # Find zipext location and add to deps
-        for module in finder.modules.values():
-            if module.__name__ == 'zipext':
-                modpath = Path(module.__file__).resolve()
-                for base in sys.path:
-                    try:
-                        relpath = modpath.relative_to(Path(base))
-                        yield base, relpath
-                        break
-                    except ValueError:
-                        continue
-
-    # Pass through original deps
-    yield from deps
+
+@functools.lru_cache(maxsize=1)
+def distributions_by_base(syspath):
+    """Group installed distributions by the directory they are installed in"""
+    # syspath is only the cache key: changing sys.path rescans
+    dists_by_base = {}
+    for dist in distributions():
+        base = os.fspath(dist.locate_file(''))
+        dists_by_base.setdefault(base, []).append(dist)
+    return dists_by_base
+
+
+# File lists of distributions, by metadata directory: (RECORD mtime, files)
+_distribution_files = {}
+
+
+def distribution_files(dist):
+    """Return files of dist, reusing them while its RECORD is unchanged"""
+    path = getattr(dist, '_path', None)
+    try:
+        key = os.fspath(path)
+        mtime = os.stat(os.path.join(key, 'RECORD')).st_mtime_ns
+    except (TypeError, OSError):
+        return dist.files or ()     # No RECORD to tell when it changes
+    cached = _distribution_files.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = _distribution_files[key] = (mtime, tuple(dist.files or ()))
+    return cached[1]
+
+
+def distribution_path_map(base, syspath):
+    """Map paths of files installed in base, relative to it, to distributions"""
+    return {
+        os.path.normpath(str(f)): dist
+        for dist in distributions_by_base(syspath).get(base, ())
+        for f in distribution_files(dist)
+    }
+
+
+def clear_caches():
+    """Forget cached module, distribution and zipext lookups"""
+    resolve_module.cache_clear()
+    resolve_dir.cache_clear()
+    find_zipext.cache_clear()
+    distributions_by_base.cache_clear()
+    _distribution_files.clear()
+
+
+def distribution_top_levels(base, syspath):
+    """Map likely top-level names to distributions in base"""
+    top_levels = {}
+    for dist in distributions_by_base(syspath).get(base, ()):
+        names = dist.read_text('top_level.txt')
+        if names is None:
+            # Newer build backends skip top_level.txt; guess the project
+            # name from the metadata directory, e.g. idna-3.4.dist-info
+            path = getattr(dist, '_path', None)
+            names = os.path.basename(path).partition('-')[0] if path else ''
+        for name in names.split():
+            top_levels.setdefault(name, []).append(dist)
+    return top_levels
 
 
 def resolve_to_distributions(module_deps):
-    # Build map of absolute file paths to distributions
-    path_map = {}
-    for dist in distributions():
-        base = Path(dist.locate_file(''))
-        for f in dist.files:
-            path_map[str(base / f)] = dist
+    # Reading a distribution's file list is the expensive part, so it is
+    # only done for directories that actually hold dependencies, and first
+    # only for distributions declaring the dependency's top-level name.
+    syspath = tuple(sys.path)
+    top_levels = {}
+    owned_files = {}
+    path_maps = {}
+
+    def find_distribution(base, relpath):
+        if base not in top_levels:
+            top_levels[base] = distribution_top_levels(base, syspath)
+        top = relpath.split(os.sep, 1)[0].split('.', 1)[0]
+        for dist in top_levels[base].get(top, ()):
+            if dist not in owned_files:
+                owned_files[dist] = {os.path.normpath(str(f))
+                                     for f in distribution_files(dist)}
+            if relpath in owned_files[dist]:
+                return dist
+
+        # Not found under its name, so check every file list
+        if base not in path_maps:
+            path_maps[base] = distribution_path_map(base, syspath)
+        return path_maps[base].get(relpath)
 
     # For each dependency, return distribution if found
     seen = set()
     for base, relpath in module_deps:
-        fullpath = str(base / relpath)
-        if fullpath not in path_map:
+        dist = find_distribution(str(base), str(relpath))
+        if dist is None:
             yield base, relpath
             continue
-        dist = path_map[fullpath]
         if dist in seen:
             continue
         seen.add(dist)
@@ -213,74 +536,345 @@ def expand_distributions(mixed_deps, exclude_pyc=True):
             continue
 
         # Expand distribution files
+        # File list was already read for resolve_to_distributions()
         base = Path(item.locate_file(''))
-        for file in item.files:
+        for file in distribution_files(item):
             # Skip .pyc files if requested
-            if exclude_pyc and file.name.endswith('.pyc'):
+            if exclude_pyc and file.suffix == '.pyc':
                 continue
             # Skip files that try to escape package directory
-            try:
-                base.joinpath(file).relative_to(base)
-            except ValueError:
+            relpath = Path(file)
+            if relpath.is_absolute() or '..' in relpath.parts:
                 continue
-            yield base, Path(file)
+            yield base, relpath
 
 
-def create_zip_archive(file_deps, timestamp, uncompressed=False):
-    buffer = io.BytesIO()
-    compression = zipfile.ZIP_STORED if uncompressed else zipfile.ZIP_DEFLATED
-    with zipfile.ZipFile(buffer, 'w', compression=compression) as zf:
+def compress_file(fullpath, compression, compresslevel=None):
+    """Read file and prepare its zip entry: (size, crc, compress_type, payload)
+
+    For files too large to hold in memory, crc and payload are None and the
+    file is left for the writer to stream into the zip. It is stored rather
+    than compressed if a sample from its start does not shrink.
+    """
+    if os.path.splitext(fullpath)[1].lower() in COMPRESSED_SUFFIXES:
+        compression = zipfile.ZIP_STORED
+    try:
+        with open(fullpath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > MAX_BUFFERED_SIZE:
+                if compression != zipfile.ZIP_STORED:
+                    sample = f.read(STREAM_CHUNK_SIZE)
+                    if len(zlib.compress(sample, FAST_DEFLATE_LEVEL)) >= len(sample):
+                        compression = zipfile.ZIP_STORED
+                return size, None, compression, None
+            data = f.read()
+    except FileNotFoundError:
+        return None     # Listed in a distribution's RECORD but not installed
+    crc = zlib.crc32(data)
+    if compression == zipfile.ZIP_STORED or len(data) < MIN_DEFLATE_SIZE:
+        return len(data), crc, zipfile.ZIP_STORED, data
+
+    if compression == zipfile.ZIP_DEFLATED:
+        # Raw deflate stream, as zipfile itself would write it
+        if compresslevel is None:
+            compresslevel = DEFLATE_LEVEL
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        payload = compressor.compress(data) + compressor.flush()
+    else:
+        from compression import zstd    # Python 3.14+, as is ZIP_ZSTANDARD
+        payload = zstd.compress(data, compresslevel or ZSTD_LEVEL)
+    if len(payload) >= len(data):
+        return len(data), crc, zipfile.ZIP_STORED, data
+    return len(data), crc, compression, payload
+
+
+def write_streamed(zf, info, fullpath, compresslevel=None):
+    """Add entry by streaming fullpath through zipfile's own compressor"""
+    if compresslevel is None and info.compress_type == zipfile.ZIP_DEFLATED:
+        compresslevel = STREAMED_DEFLATE_LEVEL
+    if hasattr(zipfile.ZipInfo, '_compresslevel'):     # Python 3.7+
+        info._compresslevel = compresslevel
+    with open(fullpath, 'rb') as src, zf.open(info, 'w') as dst:
+        shutil.copyfileobj(src, dst, STREAM_CHUNK_SIZE)
+
+
+def write_compressed(zf, info, payload):
+    """Add entry whose payload is already compressed as info.compress_type"""
+    info.compress_size = len(payload)
+    zf.fp.seek(zf.start_dir)
+    info.header_offset = zf.fp.tell()
+    zf._writecheck(info)
+    zf._didModify = True
+    zf.fp.write(info.FileHeader())
+    zf.fp.write(payload)
+    zf.start_dir = zf.fp.tell()
+    zf.filelist.append(info)
+    zf.NameToInfo[info.filename] = info
+
+
+def map_prefetch(pool, func, items, window=PREFETCH_WINDOW):
+    """Like pool.map, but with at most window results pending at a time"""
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def compile_bootstrap():
+    """Compile bootstrap code to an unchecked hash-based pyc (PEP 552)"""
+    code = compile(BOOTSTRAP_CODE, '__main__.py', 'exec')
+    return (importlib.util.MAGIC_NUMBER + (0b01).to_bytes(4, 'little') +
+            importlib.util.source_hash(BOOTSTRAP_CODE) + marshal.dumps(code))
+
+
+def make_zipinfo(arcname, date_time, compress_type):
+    """Create entry for a regular file without stat()ing the source"""
+    info = zipfile.ZipInfo(arcname, date_time)
+    info.compress_type = compress_type
+    info.external_attr = 0o100644 << 16     # -rw-r--r--
+    return info
+
+
+def create_zip_archive(fp, file_deps, timestamp, uncompressed=False,
+                       compresslevel=None, zstd=False):
+    """Write marker and zip of file_deps to fp at its current position"""
+    fp.write(CARRYON_MARKER)
+    if uncompressed:
+        compression = zipfile.ZIP_STORED
+    elif zstd:
+        compression = zipfile.ZIP_ZSTANDARD
+    else:
+        compression = zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(fp, 'w', compression=compression) as zf:
         # Convert time to zip format
         date_time = datetime.fromtimestamp(timestamp).timetuple()[:6]
 
         # Add bootstrap code as __main__.py
-        main = zipfile.ZipInfo('__main__.py')
-        main.date_time = date_time
-        main.compress_type = compression
+        main = make_zipinfo('__main__.py', date_time, compression)
         zf.writestr(main, BOOTSTRAP_CODE)
 
-        entries = [(relpath, base) for base, relpath in file_deps]
-        for relpath, base in sorted(entries):
-            fullpath = base / relpath
-            info = zipfile.ZipInfo.from_file(fullpath, str(relpath))
-            info.date_time = date_time
-            info.compress_type = compression
-            zf.writestr(info, fullpath.read_bytes())
-    return CARRYON_MARKER + buffer.getvalue()
+        # zipimport prefers __main__.pyc, saving a compile on every start;
+        # other Python versions reject its magic number and use the source
+        if hasattr(importlib.util, 'source_hash'):     # Python 3.7+
+            main = make_zipinfo('__main__.pyc', date_time, compression)
+            zf.writestr(main, compile_bootstrap())
+
+        # zlib and zstd release the GIL, so files are read and compressed in
+        # parallel threads while entries are written here in sorted order.
+        # Reading ahead is bounded so finished payloads don't pile up.
+        # Each arcname is added once, from the first base it was found in
+        # (dependency scan order, which is deterministic);
+        # sorting on arcname strings rather than Path objects is cheaper.
+        # The bootstrap must stay the only __main__ entry, as it looks
+        # itself up by name to find where the script ends.
+        bases = {}
+        for base, relpath in file_deps:
+            arcname = str(relpath)
+            if arcname not in BOOTSTRAP_NAMES:
+                bases.setdefault(arcname, base)
+        entries = sorted(bases.items(), key=lambda entry: entry[0])
+        for dirname in namespace_dirs(bases):
+            info = make_zipinfo(dirname, date_time, zipfile.ZIP_STORED)
+            info.external_attr = 0o40755 << 16 | 0x10     # drwxr-xr-x, MS-DOS dir
+            zf.writestr(info, b'')
+        paths = [os.path.join(base, arcname) for arcname, base in entries]
+        compress = functools.partial(compress_file, compression=compression,
+                                     compresslevel=compresslevel)
+        if uncompressed or len(paths) < MIN_PARALLEL_FILES:
+            # Not worth starting threads when there is little to compress
+            write_entries(zf, entries, map(compress, paths), date_time,
+                          compresslevel)
+            return
+        with ThreadPoolExecutor() as pool:
+            write_entries(zf, entries, map_prefetch(pool, compress, paths),
+                          date_time, compresslevel)
+
+
+def namespace_dirs(arcnames):
+    """Return sorted directory entries needed for namespace packages"""
+    # zipimport only finds a package without __init__ through an entry
+    # for its directory; regular packages don't need one
+    dirnames = set()
+    for arcname in arcnames:
+        parts = arcname.replace(os.sep, '/').split('/')[:-1]
+        dirnames.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    regular = {os.path.dirname(arcname.replace(os.sep, '/'))
+               for arcname in arcnames
+               if os.path.basename(arcname).startswith('__init__.')}
+    return sorted(dirname + '/' for dirname in dirnames - regular)
+
+
+def write_entries(zf, entries, results, date_time, compresslevel):
+    """Write (arcname, base) entries using their compress_file() results"""
+    for (arcname, base), result in zip(entries, results):
+        if result is None:
+            continue
+        size, crc, method, payload = result
+        info = make_zipinfo(arcname, date_time, method)
+        info.file_size = size
+        if payload is None:
+            write_streamed(zf, info, os.path.join(base, arcname), compresslevel)
+            continue
+        info.CRC = crc
+        write_compressed(zf, info, payload)
+
+
+def write_script_with_zip(temp_path, script_path, file_deps, timestamp,
+                          uncompressed=False, compresslevel=None, zstd=False):
+    """Write script content followed by its zip, removing temp_path on error"""
+    try:
+        with open(temp_path, 'wb') as fp:
+            copy_script(script_path, fp)
+            create_zip_archive(fp, file_deps, timestamp, uncompressed,
+                               compresslevel, zstd)
+    except BaseException:
+        remove_temp(temp_path)
+        raise
+
+
+def remove_temp(temp_path):
+    """Remove temp_path if it was created"""
+    try:
+        temp_path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def iter_files(root):
+    """Generate paths of files below root, relative to it"""
+    # DirEntry caches file type from the directory read, saving a stat()
+    # per entry; symlinked directories are not followed.
+    stack = ['']
+    while stack:
+        reldir = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root, reldir))
+        except PermissionError:
+            continue    # Skipped, as rglob did
+        with it:
+            for entry in it:
+                relpath = os.path.join(reldir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(relpath)
+                elif entry.is_file():
+                    yield relpath
 
 
 def collect_from_directory(dirpath):
     """Generate base, relpath pairs from an unpacked directory"""
+    # Unordered: create_zip_archive sorts all entries anyway
     base = Path(dirpath)
-    for path in sorted(base.rglob('*')):
-        if path.is_file():
-            yield base, path.relative_to(base)
+    for relpath in iter_files(base):
+        yield base, Path(relpath)
+
+
+def find_zip_start(data):
+    """Find offset of the first zip entry from the archive's trailer"""
+    # The end of central directory record is followed only by a comment
+    pos = data.rfind(zipfile.stringEndArchive,
+                     max(0, len(data) - zipfile.sizeEndCentDir - 0xFFFF))
+    end = data[pos:pos + zipfile.sizeEndCentDir]
+    if pos == -1 or len(end) != zipfile.sizeEndCentDir:
+        return None
+    end = struct.unpack(zipfile.structEndArchive, end)
+    count, cd_size, cd_offset = end[4], end[5], end[6]
+    if count in (0, 0xFFFF) or cd_offset == 0xFFFFFFFF:
+        return None     # Empty or zip64 archive
+
+    # Offsets are relative to the zip start when data was prepended to it
+    cd_pos = pos - cd_size
+    header = data[cd_pos:cd_pos + zipfile.sizeCentralDir]
+    if cd_pos < 0 or header[:4] != zipfile.stringCentralDir:
+        return None
+    header_offset = struct.unpack(zipfile.structCentralDir, header)[-1]
+    return header_offset + cd_pos - cd_offset
 
 
 def find_script_size(path):
     """Find size of script without appended zip"""
-    data = path.read_bytes()
-    # First try to find the marker
-    marker_pos = data.find(CARRYON_MARKER)
-    if marker_pos != -1:
-        return marker_pos
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0    # Empty files cannot be mapped
+        # Map the file rather than reading a possibly large bundle into memory
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # First try to find the marker
+            marker_pos = data.find(CARRYON_MARKER)
+            if marker_pos != -1:
+                return marker_pos
+
+            # If no marker found, try to find zip header
+            start = find_zip_start(data)
+            if start is not None:
+                return start
+            if len(data) < zipfile.sizeEndCentDir:
+                return len(data)    # Too short to hold a zip at all
+            try:
+                with zipfile.ZipFile(data) as zf:
+                    return zf.filelist[0].header_offset
+            except (zipfile.BadZipFile, IndexError):
+                return len(data)
+
+
+def copy_prefix(src, dst, size):
+    """Copy the first size bytes of file src to the current position of dst"""
+    dst.flush()
+    start = dst.tell()
+    copied = 0
+    # Copy in the kernel where possible; sendfile() may refuse when the
+    # destination is not a socket on this platform, or is on an odd fs
+    if hasattr(os, 'sendfile'):
+        try:
+            while copied < size:
+                sent = os.sendfile(dst.fileno(), src.fileno(), copied,
+                                   size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError:
+            pass
+        dst.seek(start + copied)
+    src.seek(copied)
+    while copied < size:
+        chunk = src.read(min(STREAM_CHUNK_SIZE, size - copied))
+        if not chunk:
+            break
+        dst.write(chunk)
+        copied += len(chunk)
 
-    # If no marker found, try to find zip header
-    try:
-        with zipfile.ZipFile(io.BytesIO(data)) as zf:
-            return zf.filelist[0].header_offset
-    except zipfile.BadZipFile:
-        return len(data)
+
+def copy_script(path, dst):
+    """Copy script content without any appended zip to file dst"""
+    size = find_script_size(path)
+    with open(path, 'rb') as f:
+        copy_prefix(f, dst, size)
 
 
-def pack(script_path, output_path=None, uncompressed=False, skip_pkgs=False, excludes=None):
+def write_script(temp_path, script_path):
+    """Write script content of script_path to temp_path, removing it on error"""
+    # Fail on an unreadable script before creating temp_path
+    size = find_script_size(script_path)
+    with open(script_path, 'rb') as src:
+        try:
+            with open(temp_path, 'wb') as dst:
+                copy_prefix(src, dst, size)
+        except BaseException:
+            remove_temp(temp_path)
+            raise
+
+
+def pack(script_path, output_path=None, uncompressed=False, skip_pkgs=False, excludes=None,
+         compresslevel=None, zstd=False, use_cache=True):
     """Generate and append zip to script"""
     script_path = Path(script_path)
     output_path = output_path or script_path
 
     # Create zip of dependencies with script's timestamp
     timestamp = script_path.stat().st_mtime
-    deps = find_module_dependencies(script_path)
+    imports_cache = load_imports_cache(script_path) if use_cache else None
+    deps = find_module_dependencies(script_path, imports_cache)
     try:
         deps = process_extension_modules(deps)
         if skip_pkgs:
@@ -290,14 +884,19 @@ def pack(script_path, output_path=None, uncompressed=False, skip_pkgs=False, exc
             mixed_deps = filter_mixed_deps(mixed_deps, excludes)
             file_deps = expand_distributions(mixed_deps)
             file_deps = filter_file_deps(file_deps, excludes)
-        zip = create_zip_archive(file_deps, timestamp, uncompressed)
+
+        # Create temporary file
+        temp_path = output_path.with_suffix('.CarryOn.tmp')
+        write_script_with_zip(temp_path, script_path, file_deps,
+                              timestamp, uncompressed, compresslevel, zstd)
     except ZipextNotFoundError as e:
         print(str(e), file=sys.stderr)
         sys.exit(1)
-
-    # Create temporary file
-    temp_path = output_path.with_suffix('.CarryOn.tmp')
-    temp_path.write_bytes(script_path.read_bytes() + zip)
+    except SyntaxError as e:
+        print(f"Cannot scan {script_path} for imports: {e}", file=sys.stderr)
+        sys.exit(1)
+    if use_cache:
+        save_imports_cache(script_path, imports_cache)
 
     # Copy metadata and replace target
     shutil.copystat(script_path, temp_path)
@@ -309,13 +908,9 @@ def strip(script_path, output_path=None):
     script_path = Path(script_path)
     output_path = output_path or script_path
 
-    # Get size of original script before zip
-    size = find_script_size(script_path)
-
-    # Create temporary file
+    # Create temporary file with original script before zip
     temp_path = output_path.with_suffix('.CarryOn.tmp')
-    data = script_path.read_bytes()[:size]
-    temp_path.write_bytes(data)
+    write_script(temp_path, script_path)
 
     # Copy metadata and replace target
     shutil.copystat(script_path, temp_path)
@@ -335,27 +930,22 @@ def unpack(script_path, output_path=None):
     if unpack_dir.exists():
         print(f"Note: {unpack_dir} already exists. Consider removing it first.")
 
-    # Get size of original script before zip
-    size = find_script_size(script_path)
-
-    # Read and process data
-    data = script_path.read_bytes()
-
-    # Extract the zip contents
-    with zipfile.ZipFile(io.BytesIO(data)) as zf:
-        members = [f for f in zf.filelist if f.filename != '__main__.py']
+    # Extract the zip contents, reading only the members from disk
+    with zipfile.ZipFile(script_path) as zf:
+        members = [f for f in zf.filelist if f.filename not in BOOTSTRAP_NAMES]
         zf.extractall(unpack_dir, members)
 
     # Create temporary file with stripped script
     temp_path = output_path.with_suffix('.CarryOn.tmp')
-    temp_path.write_bytes(data[:size])
+    write_script(temp_path, script_path)
 
     # Copy metadata and replace target
     shutil.copystat(script_path, temp_path)
     temp_path.replace(output_path)
 
 
-def repack(script_path, output_path=None, uncompressed=False, excludes=None):
+def repack(script_path, output_path=None, uncompressed=False, excludes=None,
+           compresslevel=None, zstd=False):
     """Repack zip from unpacked directory and create stripped file"""
     script_path = Path(script_path)
     if output_path is None:
@@ -363,10 +953,9 @@ def repack(script_path, output_path=None, uncompressed=False, excludes=None):
     else:
         output_path = Path(output_path)
     dir_path = script_path.with_suffix('.d')
-
-    # Get original script content without zip
-    size = find_script_size(script_path)
-    script_content = script_path.read_bytes()[:size]
+    if not dir_path.is_dir():
+        print(f"{dir_path} not found. Run unpack first.", file=sys.stderr)
+        sys.exit(1)
 
     # Create zip from directory contents with script's timestamp
     timestamp = script_path.stat().st_mtime
@@ -374,13 +963,14 @@ def repack(script_path, output_path=None, uncompressed=False, excludes=None):
     try:
         file_deps = process_extension_modules(file_deps)
         file_deps = filter_file_deps(file_deps, excludes)
-        zip = create_zip_archive(file_deps, timestamp, uncompressed)
+
+        # Create temporary file
+        temp_path = output_path.with_suffix('.CarryOn.tmp')
+        write_script_with_zip(temp_path, script_path, file_deps,
+                              timestamp, uncompressed, compresslevel, zstd)
     except ZipextNotFoundError as e:
         print(str(e), file=sys.stderr)
         sys.exit(1)
-    # Create temporary file
-    temp_path = output_path.with_suffix('.CarryOn.tmp')
-    temp_path.write_bytes(script_content + zip)
 
     # Copy metadata and replace target
     shutil.copystat(script_path, temp_path)
@@ -392,11 +982,18 @@ def distributions_fallback():
     class Dist:
         def __init__(self, dist):
             self.name = dist.name
-            self._base = Path(dist.path).parent
+            self._path = Path(dist.path)
+            self._base = self._path.parent
             self.files = [Path(f[0]) for f in dist.list_installed_files()]
 
         def locate_file(self, path):
             return self._base / path
+
+        def read_text(self, filename):
+            try:
+                return (self._path / filename).read_text(encoding='utf-8')
+            except OSError:
+                return None
     from pip._vendor.distlib.database import DistributionPath
     return (Dist(d) for d in DistributionPath().get_distributions())
 
@@ -414,24 +1011,43 @@ def main():
                         'pack', 'strip', 'unpack', 'repack'])
     parser.add_argument('script', type=Path, help='Python script to process')
     parser.add_argument('-o', '--output', type=Path, help='Output file')
-    parser.add_argument('-0', '--uncompressed', action='store_true',
-                        help='Store files uncompressed (default is to use deflate compression)')
+    compression = parser.add_mutually_exclusive_group()
+    compression.add_argument('-0', '--uncompressed', action='store_true',
+                             help='Store files uncompressed (default is to use deflate compression)')
+    compression.add_argument('--fast', dest='compresslevel', action='store_const',
+                             const=FAST_DEFLATE_LEVEL,
+                             help='Use the fastest deflate level, for quick iteration')
+    compression.add_argument('--best', dest='compresslevel', action='store_const',
+                             const=BEST_DEFLATE_LEVEL,
+                             help='Use the best deflate level, for release builds')
+    compression.add_argument('-l', '--compress-level', dest='compresslevel', type=int,
+                             choices=range(10), metavar='N',
+                             help='Use deflate level N (0-9, default %d, or %d for files over %d MiB)'
+                             % (DEFLATE_LEVEL, STREAMED_DEFLATE_LEVEL, MAX_BUFFERED_SIZE >> 20))
+    compression.add_argument('--zstd', action='store_true',
+                             help='Compress with Zstandard (Python 3.14+ to pack and to run)')
     parser.add_argument('-m', '--modules-only', action='store_true',
                         help='Skip package resolution and pack module files directly')
     parser.add_argument('-x', '--exclude', action='append',
                         help='Exclude package or module (may be specified multiple times, comma-separated)')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help="Don't read or write the cache of scanned imports")
 
     args = parser.parse_args()
+    if args.zstd and not hasattr(zipfile, 'ZIP_ZSTANDARD'):
+        parser.error('--zstd requires Python 3.14 or later')
 
     if args.command == 'pack':
         pack(args.script, args.output, args.uncompressed,
-             args.modules_only, args.exclude)
+             args.modules_only, args.exclude, args.compresslevel, args.zstd,
+             args.use_cache)
     elif args.command == 'strip':
         strip(args.script, args.output)
     elif args.command == 'unpack':
         unpack(args.script, args.output)
     elif args.command == 'repack':
-        repack(args.script, args.output, args.uncompressed, args.exclude)
+        repack(args.script, args.output, args.uncompressed, args.exclude,
+               args.compresslevel, args.zstd)
 
 
 if __name__ == '__main__':